@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Entry point WSGI per gunicorn.
+
+Avvio produzione:
+    gunicorn -k gthread --threads 4 -b 0.0.0.0:$PORT --timeout 120 wsgi:application
+
+Il numero di worker si controlla con la variabile WEB_CONCURRENCY
+(letta nativamente da gunicorn) o con -w N.
+"""
+from telegram_file_processor import app
+
+application = app